@@ -1,15 +1,21 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
-from google import genai
-import plotly.express as px
+import numpy as np
 import os
-import json
+import orjson
+import asyncio
 import base64
+import functools
+import hashlib
+import io
+import random
+import time
 from datetime import datetime
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import yfinance as yf
-from PIL import Image
+from operator import itemgetter
+from string import Template
+try: import ciso8601
+except ImportError: ciso8601 = None
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -19,6 +25,109 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# --- CONSTANTS ---
+MONTHS = ("January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December")
+MONTH_INDEX = {m: i for i, m in enumerate(MONTHS)}
+CURRENCIES = ("MYR", "USD", "GBP", "SGD", "EUR", "AUD", "JPY")
+DURATION_MONTHS = {"1 Year": 12, "3 Years": 36, "5 Years": 60, "10 Years": 120}
+CURRENT_YEAR = datetime.now().year
+HISTORY_DTYPES = {"Year": "int64", "EPF_Rate": "int64", "Basic_Salary": "float64", "Allowances": "float64", "Variable_Income": "float64",
+                  "Current_Savings": "float64", "Net_Income": "float64", "Total_Expenses": "float64", "Balance": "float64", "EPF_Savings": "float64"}
+
+# --- THEME ---
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_theme_css(bg_css, font_name, font_size, text_color):
+    # Formatted once per theme choice; reruns reuse the same string
+    font_url_name = font_name.replace(" ", "+")
+    # <style> must open the markdown: a leading <link> would make it an HTML block that ends at the first blank line
+    return f"""
+<style>
+    /* DYNAMIC FONT IMPORT */
+    @import url('https://fonts.googleapis.com/css2?family={font_url_name}:wght@400;600;700&display=swap');
+
+    /* ROOT STYLES */
+    html, body, [class*="css"], .stMarkdown, .stText {{
+        font-family: '{font_name}', sans-serif !important;
+        font-size: {font_size}px !important;
+        color: {text_color} !important;
+    }}
+    
+    /* BACKGROUND */
+    .stApp {{
+        {bg_css}
+        background-attachment: fixed;
+    }}
+
+    /* CARD UI (GLASSMORPHISM) */
+    .stContainer {{
+        background-color: rgba(255, 255, 255, 0.95);
+        border-radius: 16px;
+        padding: 24px;
+        box-shadow: 0 8px 32px 0 rgba(31, 38, 135, 0.07);
+        backdrop-filter: blur(4px);
+        -webkit-backdrop-filter: blur(4px);
+        border: 1px solid rgba(255, 255, 255, 0.18);
+        margin-bottom: 24px;
+    }}
+
+    /* HEADERS */
+    h1, h2, h3, h4 {{
+        color: {text_color} !important;
+        font-family: '{font_name}', sans-serif !important;
+    }}
+
+    /* INPUTS */
+    .stTextInput>div>div>input, .stNumberInput>div>div>input, .stSelectbox>div>div>div {{
+        border-radius: 8px; border: 1px solid #cbd5e1; color: #334155; font-family: '{font_name}', sans-serif;
+    }}
+
+    /* BUTTONS */
+    .stButton>button {{
+        width: 100%; border-radius: 10px; font-weight: 600; border: none; padding: 0.6rem 1rem;
+        background-color: #ffffff; color: #0f172a; border: 1px solid #e2e8f0;
+        transition: all 0.2s;
+        font-family: '{font_name}', sans-serif;
+    }}
+    .stButton>button:hover {{ background-color: #f1f5f9; }}
+    
+    /* PRIMARY BUTTONS */
+    div[data-testid="stVerticalBlock"] > div > div > div > div > button[kind="primary"] {{
+        background: linear-gradient(135deg, #2563eb 0%, #1d4ed8 100%);
+        color: white !important; border: none;
+        box-shadow: 0 4px 6px -1px rgba(37, 99, 235, 0.2);
+    }}
+
+    /* METRICS */
+    [data-testid="stMetricValue"] {{ font-weight: 700; color: {text_color} !important; font-family: '{font_name}', sans-serif; }}
+    [data-testid="stMetricLabel"] {{ font-weight: 600; opacity: 0.7; font-family: '{font_name}', sans-serif; }}
+
+    /* BADGES */
+    .total-badge {{
+        padding: 8px 12px; border-radius: 8px; font-weight: 600; font-size: 0.9rem;
+        display: inline-block; margin-top: 10px; width: 100%; text-align: center;
+        font-family: '{font_name}', sans-serif;
+    }}
+    .badge-green {{ background-color: #dcfce7; color: #166534 !important; border: 1px solid #bbf7d0; }}
+    .badge-red {{ background-color: #fee2e2; color: #991b1b !important; border: 1px solid #fecaca; }}
+    .badge-blue {{ background-color: #dbeafe; color: #1e40af !important; border: 1px solid #bfdbfe; }}
+
+    /* AI BOX */
+    .ai-box {{
+        background-color: #0f172a; border-radius: 12px; padding: 20px;
+        color: #e2e8f0 !important; border-left: 4px solid #6366f1;
+    }}
+    .ai-box h3 {{ color: #e2e8f0 !important; }} 
+    
+    /* TABLE */
+    [data-testid="stDataEditor"] {{ border: 1px solid #e2e8f0; border-radius: 10px; overflow: hidden; }}
+    
+    /* REMOVE TOP PADDING */
+    .block-container {{ padding-top: 2rem; }}
+</style>
+<link rel="preconnect" href="https://fonts.googleapis.com">
+<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
+"""
+
 # --- SIDEBAR: APPEARANCE & CONFIG ---
 with st.sidebar:
     st.title("⚙️ Settings")
@@ -43,7 +152,7 @@ with st.sidebar:
                 try:
                     b64 = base64.b64encode(bg_file.getvalue()).decode()
                     bg_css = f'background-image: url("data:image/png;base64,{b64}"); background-size: cover; background-repeat: no-repeat;'
-                except: st.error("Image Error")
+                except (OSError, ValueError): st.error("Image Error")
 
         st.caption("Typography")
         font_name = st.selectbox("Font Family", ["Inter", "Roboto", "Poppins", "Lato", "Montserrat", "Open Sans"])
@@ -51,93 +160,7 @@ with st.sidebar:
         text_color = st.color_picker("Text Color", "#0f172a")
 
     # --- DYNAMIC CSS INJECTION ---
-    font_url_name = font_name.replace(" ", "+")
-    
-    st.markdown(f"""
-    <style>
-        /* DYNAMIC FONT IMPORT */
-        @import url('https://fonts.googleapis.com/css2?family={font_url_name}:wght@400;600;700&display=swap');
-
-        /* ROOT STYLES */
-        html, body, [class*="css"], .stMarkdown, .stText {{
-            font-family: '{font_name}', sans-serif !important;
-            font-size: {font_size}px !important;
-            color: {text_color} !important;
-        }}
-        
-        /* BACKGROUND */
-        .stApp {{
-            {bg_css}
-            background-attachment: fixed;
-        }}
-
-        /* CARD UI (GLASSMORPHISM) */
-        .stContainer {{
-            background-color: rgba(255, 255, 255, 0.95);
-            border-radius: 16px;
-            padding: 24px;
-            box-shadow: 0 8px 32px 0 rgba(31, 38, 135, 0.07);
-            backdrop-filter: blur(4px);
-            -webkit-backdrop-filter: blur(4px);
-            border: 1px solid rgba(255, 255, 255, 0.18);
-            margin-bottom: 24px;
-        }}
-
-        /* HEADERS */
-        h1, h2, h3, h4 {{
-            color: {text_color} !important;
-            font-family: '{font_name}', sans-serif !important;
-        }}
-
-        /* INPUTS */
-        .stTextInput>div>div>input, .stNumberInput>div>div>input, .stSelectbox>div>div>div {{
-            border-radius: 8px; border: 1px solid #cbd5e1; color: #334155; font-family: '{font_name}', sans-serif;
-        }}
-
-        /* BUTTONS */
-        .stButton>button {{
-            width: 100%; border-radius: 10px; font-weight: 600; border: none; padding: 0.6rem 1rem;
-            background-color: #ffffff; color: #0f172a; border: 1px solid #e2e8f0;
-            transition: all 0.2s;
-            font-family: '{font_name}', sans-serif;
-        }}
-        .stButton>button:hover {{ background-color: #f1f5f9; }}
-        
-        /* PRIMARY BUTTONS */
-        div[data-testid="stVerticalBlock"] > div > div > div > div > button[kind="primary"] {{
-            background: linear-gradient(135deg, #2563eb 0%, #1d4ed8 100%);
-            color: white !important; border: none;
-            box-shadow: 0 4px 6px -1px rgba(37, 99, 235, 0.2);
-        }}
-
-        /* METRICS */
-        [data-testid="stMetricValue"] {{ font-weight: 700; color: {text_color} !important; font-family: '{font_name}', sans-serif; }}
-        [data-testid="stMetricLabel"] {{ font-weight: 600; opacity: 0.7; font-family: '{font_name}', sans-serif; }}
-
-        /* BADGES */
-        .total-badge {{
-            padding: 8px 12px; border-radius: 8px; font-weight: 600; font-size: 0.9rem;
-            display: inline-block; margin-top: 10px; width: 100%; text-align: center;
-            font-family: '{font_name}', sans-serif;
-        }}
-        .badge-green {{ background-color: #dcfce7; color: #166534 !important; border: 1px solid #bbf7d0; }}
-        .badge-red {{ background-color: #fee2e2; color: #991b1b !important; border: 1px solid #fecaca; }}
-        .badge-blue {{ background-color: #dbeafe; color: #1e40af !important; border: 1px solid #bfdbfe; }}
-
-        /* AI BOX */
-        .ai-box {{
-            background-color: #0f172a; border-radius: 12px; padding: 20px;
-            color: #e2e8f0 !important; border-left: 4px solid #6366f1;
-        }}
-        .ai-box h3 {{ color: #e2e8f0 !important; }} 
-        
-        /* TABLE */
-        [data-testid="stDataEditor"] {{ border: 1px solid #e2e8f0; border-radius: 10px; overflow: hidden; }}
-        
-        /* REMOVE TOP PADDING */
-        .block-container {{ padding-top: 2rem; }}
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(build_theme_css(bg_css, font_name, font_size, text_color), unsafe_allow_html=True)
 
     st.divider()
     
@@ -160,182 +183,521 @@ with st.sidebar:
     st.markdown("### 💱 Currency")
     if 'active_currency' not in st.session_state: st.session_state.active_currency = "MYR"
     
-    currency_options = ["MYR", "USD", "GBP", "SGD", "EUR", "AUD", "JPY"]
     curr_idx = 0
-    if st.session_state.active_currency in currency_options:
-        curr_idx = currency_options.index(st.session_state.active_currency)
+    if st.session_state.active_currency in CURRENCIES:
+        curr_idx = CURRENCIES.index(st.session_state.active_currency)
         
-    selected_currency = st.selectbox("Display Currency", currency_options, index=curr_idx)
+    selected_currency = st.selectbox("Display Currency", CURRENCIES, index=curr_idx)
+
+# --- AI PROMPTS ---
+AUTOFILL_PROMPT_PREFIX = 'You are a Data Entry API. Persona: "'
+AUTOFILL_PROMPT_SUFFIX = '". Return JSON: {"basic_salary": float, "allowances": float, "variable_income": float, "current_savings": float, "epf_rate": int, "expenses": [{"Category":str,"Amount":float}], "deductions": [{"Category":str,"Amount":float}]}'
+AUDIT_SECTIONS = ("1. Leakage Check", "2. Tax Reliefs", "3. Strategic Advice")
+AUDIT_MAX_OUTPUT_TOKENS = 400
+AUDIT_PRO_THINKING_BUDGET = 128  # 2.5 Pro's minimum; it can't turn thinking off
+AUDIT_HEADER = Template("""Role: Expert Financial Planner. Context: $month $year.
+Stats: Net: $curr $net, Exp: $curr $exp, Bal: $curr $bal.
+Deductions: EPF: $curr $epf
+$deductions
+Expenses: $expenses""")
 
 # --- HELPER FUNCTIONS ---
+def traced_cache(**cache_kwargs):
+    # st.cache_data plus per-session counters for the Cache stats panel: calls that reach the body are misses
+    def decorate(fn):
+        def stats():
+            return st.session_state.setdefault('_cache_stats', {}).setdefault(fn.__name__, {"calls": 0, "misses": 0, "last_miss_ms": None})
+        @functools.wraps(fn)
+        def body(*args, **kwargs):
+            t0 = time.perf_counter()
+            out = fn(*args, **kwargs)
+            entry = stats()
+            entry["misses"] += 1
+            entry["last_miss_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            return out
+        cached = st.cache_data(**cache_kwargs)(body)
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            stats()["calls"] += 1
+            return cached(*args, **kwargs)
+        call.clear = cached.clear
+        return call
+    return decorate
+
+def to_json(obj):
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+def total_amount(records):
+    # Skips blank/NaN amounts from freshly added editor rows, like Series.sum()
+    return sum(a for a in (d.get('Amount') for d in records) if a is not None and a == a)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _dump_records(records_key):
+    return to_json([dict(items) for items in records_key])
+
+def records_to_json(records):
+    # Hashable snapshot as the cache key: unchanged tables skip serialisation
+    return _dump_records(tuple(tuple(d.items()) for d in records))
+
 def get_default_state():
     return {
         "basic_salary": 6000.0, "allowances": 500.0, "variable_income": 0.0, "current_savings": 10000.0, "epf_rate": 11,
+        "month_select": "December", "year_input": CURRENT_YEAR, "currency": "MYR",
         "expenses": [{"Category": "Housing", "Amount": 1500.0}, {"Category": "Car", "Amount": 800.0}, {"Category": "Food", "Amount": 1000.0}, {"Category": "Utilities", "Amount": 300.0}, {"Category": "Loans", "Amount": 200.0}, {"Category": "Savings", "Amount": 500.0}],
         "deductions": [{"Category": "SOCSO", "Amount": 19.75}, {"Category": "EIS", "Amount": 7.90}, {"Category": "PCB", "Amount": 300.00}]
     }
 
+# History column -> (session key, cast, fallback)
+HISTORY_SCHEMA = (
+    ("Basic_Salary", "basic_salary", float, 0), ("Allowances", "allowances", float, 0),
+    ("Variable_Income", "variable_income", float, 0), ("Current_Savings", "current_savings", float, 0),
+    ("EPF_Rate", "epf_rate", int, 11), ("Expenses_JSON", "expenses", orjson.loads, '[]'),
+    ("Deductions_JSON", "deductions_list", orjson.loads, '[]'), ("Currency", "active_currency", str, "MYR"),
+)
+
+def history_row_values(row):
+    # A saved History row -> the session keys the income inputs and editors read
+    return {key: cast(row.get(col, dflt)) for col, key, cast, dflt in HISTORY_SCHEMA}
+
+# Cloud State field -> cast; read unformatted, so whole-number cells arrive as int and need float()
+STATE_SCHEMA = (
+    ("basic_salary", float), ("allowances", float), ("variable_income", float), ("current_savings", float),
+    ("epf_rate", int), ("month_select", str), ("year_input", int), ("currency", str),
+)
+
+def cloud_state_values(cs):
+    # Saved (or empty) cloud state -> typed session values; missing fields fall back to get_default_state()
+    defaults = get_default_state()
+    values = {k: cast(cs.get(k, defaults[k])) for k, cast in STATE_SCHEMA}
+    values.update(expenses=cs.get('expenses', defaults['expenses']), deductions_list=cs.get('deductions', defaults['deductions']), active_currency=values.pop('currency'))
+    return values
+
+def apply_loaded_values(values, **extra):
+    # One session_state merge for the inputs and the loaded_* defaults they fall back to
+    st.session_state.update({
+        **values, "loaded_salary": values["basic_salary"], "loaded_allowances": values["allowances"], "loaded_var": values["variable_income"],
+        "loaded_savings": values["current_savings"], "loaded_epf": values["epf_rate"], **extra,
+    })
+
+@st.cache_resource(show_spinner=False)
+def _authorize_sheets(credentials_json):
+    # google-auth service account (gspread's own helper): cryptography-backed signing, auto token refresh
+    import gspread
+    return gspread.service_account_from_dict(orjson.loads(credentials_json))
+
+@st.cache_resource(show_spinner=False)
+def _open_sheet(_client, sheet_url):
+    return _client.open_by_url(sheet_url)
+
+@st.cache_resource(show_spinner=False)
+def _worksheet(_sheet, sheet_url, title):
+    # Spreadsheet.worksheet() refetches the sheet metadata on every call; a miss raises and isn't cached
+    return _sheet.worksheet(title)
+
+def _retry(fn, *args, attempts=4, base=0.25, **kwargs):
+    # Back off and retry rate-limit / server-side Sheets errors instead of failing the whole run
+    from gspread.exceptions import APIError
+    for i in range(attempts):
+        try: return fn(*args, **kwargs)
+        except APIError as e:
+            if i == attempts - 1 or e.response.status_code not in (429, 500, 502, 503, 504): raise
+            time.sleep(base * 2 ** i + random.uniform(0, base))
+
+def _on_worksheet(sheet, title, op, create=None):
+    # op(ws) on the cached tab handle. A tab deleted/recreated since it was cached fails with a 400/404
+    # APIError rather than WorksheetNotFound, so drop the cached handles and look the tab up once more
+    from gspread.exceptions import APIError, WorksheetNotFound
+    for attempt in range(2):
+        try: ws = _retry(_worksheet, sheet, st.secrets["SHEET_URL"], title)
+        except WorksheetNotFound:
+            if create is None: raise
+            ws = create()
+        try: return op(ws)
+        except APIError as e:
+            if attempt or e.response.status_code not in (400, 404): raise
+            _worksheet.clear()
+
+def _sheets_errors():
+    # What a Sheets call can raise: API/lookup errors, token refresh, network, bad stored JSON
+    from gspread.exceptions import GSpreadException
+    from google.auth.exceptions import GoogleAuthError
+    return (GSpreadException, GoogleAuthError, OSError, orjson.JSONDecodeError)
+
 def get_google_sheet_client():
-    try:
-        if "GCP_CREDENTIALS" in st.secrets:
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(st.secrets["GCP_CREDENTIALS"]), ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive'])
-            return gspread.authorize(creds)
-    except: return None
-    return None
+    # Failures raise out of the cached helper, so they are retried next run
+    # No client without both secrets, so every later st.secrets["SHEET_URL"] lookup is safe
+    try: has_creds = "GCP_CREDENTIALS" in st.secrets and "SHEET_URL" in st.secrets
+    except FileNotFoundError: return None  # no secrets.toml at all
+    if not has_creds: return None
+    try: return _authorize_sheets(st.secrets["GCP_CREDENTIALS"])
+    # Malformed JSON or service-account fields: say so instead of quietly running without the cloud
+    except (ValueError, KeyError, TypeError) as e: st.error(f"Invalid GCP_CREDENTIALS: {e}"); return None
+
+def _export_csv(sheet, ws):
+    # Docs CSV export: one response parsed by pandas' C reader, outside the Sheets API read quota
+    resp = sheet.client.request("get", f"https://docs.google.com/spreadsheets/d/{sheet.id}/export", params={"format": "csv", "gid": ws.id})
+    if not resp.headers.get("Content-Type", "").startswith("text/csv"): return None
+    return pd.read_csv(io.BytesIO(resp.content))
 
 def get_sheet_data(worksheet_name):
     client = get_google_sheet_client()
     if client:
         try:
-            ws = client.open_by_url(st.secrets["SHEET_URL"]).worksheet(worksheet_name)
-            df = pd.DataFrame(ws.get_all_records())
-            return df if not df.empty else pd.DataFrame()
-        except: return pd.DataFrame()
+            from gspread.exceptions import APIError
+            sheet = _open_sheet(client, st.secrets["SHEET_URL"])
+            def read(ws):
+                try: df = _export_csv(sheet, ws)
+                except APIError as e:
+                    # A stale tab id has to reach _on_worksheet; any other export failure just falls back
+                    if e.response.status_code in (400, 404): raise
+                    df = None
+                except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError, OSError): df = None
+                return df if df is not None else _retry(ws.get_all_values)
+            data = _on_worksheet(sheet, worksheet_name, read)
+            if isinstance(data, pd.DataFrame): return data
+
+            if len(data) < 2: return pd.DataFrame()
+            # Column-wise Arrow build instead of pandas' row-by-row list ingestion
+            import pyarrow as pa
+            df = pa.Table.from_arrays([pa.array(col, type=pa.string()) for col in zip(*data[1:])], names=data[0]).to_pandas()
+            # Bulk numeric coercion, standing in for get_all_records' per-cell numericise
+            for col in df.columns:
+                num = pd.to_numeric(df[col], errors='coerce')
+                if num.notna().all(): df[col] = num
+            return df
+        except _sheets_errors(): return pd.DataFrame()
     return pd.DataFrame()
 
+def parse_dates(col):
+    if pd.api.types.is_datetime64_any_dtype(col): return col
+    # ciso8601 is a C ISO-8601 parser, far quicker than pandas' generic path
+    if ciso8601 is not None:
+        # Blank cells come back as NaN: parse the filled ones and let reindex leave NaT in the gaps
+        filled = col.dropna()
+        try: return pd.Series(pd.DatetimeIndex([ciso8601.parse_datetime(v) for v in filled.astype(str)]), index=filled.index).reindex(col.index)
+        except (ValueError, TypeError): pass
+    try: return pd.to_datetime(col, format="%Y-%m-%d", cache=True)
+    except (ValueError, TypeError): return pd.to_datetime(col, cache=True)
+
+@traced_cache(ttl=300, show_spinner=False)
+def load_history_df():
+    # Cleared by save/delete, so reruns and period switches stay off the network.
+    # Dates are parsed and sorted here once rather than on every chart render.
+    df = get_sheet_data("History")
+    # Typed once here, whichever reader produced the frame; a column with blanks keeps its inferred dtype
+    df = df.astype({c: t for c, t in HISTORY_DTYPES.items() if c in df.columns}, errors='ignore')
+    if 'Date' in df.columns:
+        df['Date'] = parse_dates(df['Date'])
+        # Unnamed DatetimeIndex (so 'Date' stays unambiguous as a column); charts read it directly
+        df = df.set_index(pd.DatetimeIndex(df['Date']).rename(None)).sort_index()
+    return df
+
+@traced_cache(ttl=300, show_spinner=False)
+def load_history_index():
+    # (Month, Year) -> row and "Month Year" label -> row; first occurrence wins
+    df = load_history_df()
+    by_period, by_label = {}, {}
+    if df.empty or 'Month' not in df.columns or 'Year' not in df.columns: return by_period, by_label
+    for row in df.to_dict('records'):
+        by_period.setdefault((row['Month'], str(row['Year'])), row)
+        by_label.setdefault(f"{row['Month']} {row['Year']}", row)
+    return by_period, by_label
+
+@traced_cache(ttl=300, show_spinner=False)
+def load_history_trend():
+    # Just the chart columns as an Arrow table: native timestamp[ns] + float buffers
+    # unpickle without the object-dtype JSON/text columns riding along each rerun
+    import pyarrow as pa
+    df = load_history_df()
+    if df.empty or not {'Date', 'Net_Income', 'Balance'} <= set(df.columns): return None
+    # float32 is ample for ringgit-scale balances and halves what the chart serialises
+    series = [pd.to_numeric(df[c], errors='coerce', downcast='float').astype(np.float32).to_numpy() for c in ('Net_Income', 'Balance')]
+    return pa.Table.from_arrays([pa.array(df.index.to_numpy()), *map(pa.array, series)], names=['Date', 'Net_Income', 'Balance'])
+
+def clear_history_cache():
+    load_history_df.clear()
+    load_history_index.clear()
+    load_history_trend.clear()
+
+def _delete_row_runs(sheet, ws, rows):
+    # Collapse adjacent rows into runs -> one deleteDimension per run, bottom-up so indices don't shift
+    rows = np.sort(np.asarray(rows, dtype=np.int64))
+    runs = np.split(rows, np.flatnonzero(np.diff(rows) != 1) + 1)
+    _retry(sheet.batch_update, {"requests": [
+        {"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": int(run[0]) - 1, "endIndex": int(run[-1])}}}
+        for run in reversed(runs)
+    ]})
+
+def _key_columns(headers, *names):
+    from gspread.utils import rowcol_to_a1
+    return [f"{c}2:{c}" for c in (rowcol_to_a1(1, headers.index(n) + 1)[:-1] for n in names)]
+
 def save_row_to_history(row_data_dict):
+    # Re-saving an unchanged row is a no-op; returns False when nothing was written
+    row_hash = hashlib.blake2b(orjson.dumps(row_data_dict, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY, default=str), digest_size=16).hexdigest()
+    if st.session_state.get('_last_saved_hash') == row_hash: return False
     client = get_google_sheet_client()
     if client:
-        sheet = client.open_by_url(st.secrets["SHEET_URL"])
-        try: ws = sheet.worksheet("History")
-        except: ws = sheet.add_worksheet(title="History", rows=100, cols=20)
-        
-        expected_headers = list(row_data_dict.keys())
-        if not ws.row_values(1) or ws.row_values(1) != expected_headers:
-            ws.clear(); ws.append_row(expected_headers)
-        
-        all_values = ws.get_all_values()
-        if len(all_values) > 1:
-            df = pd.DataFrame(all_values[1:], columns=all_values[0])
-            mask = (df['Month'].astype(str) == str(row_data_dict['Month'])) & (df['Year'].astype(str) == str(row_data_dict['Year']))
-            if mask.any():
-                for idx in sorted(df.index[mask].tolist(), reverse=True): ws.delete_rows(int(idx) + 2)
-        ws.append_row(list(row_data_dict.values()))
+        sheet = _open_sheet(client, st.secrets["SHEET_URL"])
+        # RAW keeps Date as ISO text: USER_ENTERED would make it a date cell that reads back in the sheet's locale format
+        expected_headers, new_row = list(row_data_dict.keys()), list(row_data_dict.values())
+        def write(ws):
+            # Header + the two key columns only, not the whole sheet
+            header, month_vals, year_vals = _retry(ws.batch_get, ["1:1"] + _key_columns(expected_headers, 'Month', 'Year'))
+            if not header or header[0] != expected_headers:
+                # Empty or foreign layout: reset to our header + this row
+                _retry(ws.clear)
+                _retry(ws.update, range_name="A1", values=[expected_headers, new_row], value_input_option="RAW")
+            else:
+                key = (str(row_data_dict['Month']), str(row_data_dict['Year']))
+                matches = [i + 2 for i, (m, y) in enumerate(zip(month_vals, year_vals)) if m and y and (m[0], y[0]) == key]
+                if matches:
+                    # Overwrite the month's row in place; drop any older duplicates
+                    _retry(ws.update, range_name=f"A{matches[0]}", values=[new_row], value_input_option="RAW")
+                    if len(matches) > 1: _delete_row_runs(sheet, ws, matches[1:])
+                else: _retry(ws.append_row, new_row, value_input_option="RAW", table_range="A1")
+        # Only a genuinely missing tab is created; rate limits/outages retry or raise instead
+        _on_worksheet(sheet, "History", write, create=lambda: sheet.add_worksheet(title="History", rows=100, cols=20))
+        clear_history_cache()
+        st.session_state['_last_saved_hash'] = row_hash
+    return True
 
 def delete_rows_from_sheet(worksheet_name, month_year_list):
     client = get_google_sheet_client()
     if client:
-        ws = client.open_by_url(st.secrets["SHEET_URL"]).worksheet(worksheet_name)
-        df = pd.DataFrame(ws.get_all_records())
-        if not df.empty:
-            df['Label'] = df['Month'] + " " + df['Year'].astype(str)
-            df_clean = df[~df['Label'].isin(month_year_list)].drop(columns=['Label'])
-            ws.clear(); ws.update([df_clean.columns.values.tolist()] + df_clean.values.tolist())
+        sheet = _open_sheet(client, st.secrets["SHEET_URL"])
+        def delete(ws):
+            headers = _retry(ws.row_values, 1)
+            if 'Month' not in headers or 'Year' not in headers: return
+
+            # Only pull the two filter columns, not the whole sheet
+            month_vals, year_vals = _retry(ws.batch_get, _key_columns(headers, 'Month', 'Year'))
+
+            targets = set(month_year_list)
+            rows = [i + 2 for i, (m, y) in enumerate(zip(month_vals, year_vals)) if m and y and f"{m[0]} {y[0]}" in targets]
+            if rows:
+                _delete_row_runs(sheet, ws, rows)
+                # The last saved row may be gone now, so the next Save must write
+                st.session_state.pop('_last_saved_hash', None)
+        _on_worksheet(sheet, worksheet_name, delete)
 
 def save_cloud_state():
     state_data = {
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "expenses": json.dumps(st.session_state.get('expenses', [])),
-        "deductions": json.dumps(st.session_state.get('deductions_list', [])),
+        "expenses": records_to_json(st.session_state.get('expenses', [])),
+        "deductions": records_to_json(st.session_state.get('deductions_list', [])),
         "basic_salary": st.session_state.get('basic_salary', 6000.0),
         "allowances": st.session_state.get('allowances', 500.0),
         "variable_income": st.session_state.get('variable_income', 0.0),
         "current_savings": st.session_state.get('current_savings', 10000.0),
         "epf_rate": st.session_state.get('epf_rate', 11),
         "month_select": st.session_state.get('month_select', "December"),
-        "year_input": st.session_state.get('year_input', datetime.now().year),
+        "year_input": st.session_state.get('year_input', CURRENT_YEAR),
         "currency": st.session_state.get('active_currency', "MYR")
     }
+    # Skip the write if nothing but the timestamp changed since the last upload; returns False then
+    payload = {k: v for k, v in state_data.items() if k != "timestamp"}
+    state_hash = hashlib.blake2b(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY, default=str), digest_size=16).hexdigest()
+    if st.session_state.get('_last_state_hash') == state_hash: return False
+
     client = get_google_sheet_client()
     if client:
-        try: ws = client.open_by_url(st.secrets["SHEET_URL"]).worksheet("State")
-        except: ws = client.open_by_url(st.secrets["SHEET_URL"]).add_worksheet(title="State", rows=2, cols=10)
-        ws.clear(); ws.append_row(list(state_data.keys())); ws.append_row(list(state_data.values()))
+        sheet = _open_sheet(client, st.secrets["SHEET_URL"])
+        _on_worksheet(sheet, "State", lambda ws: _retry(ws.update, range_name="A1", values=[list(state_data.keys()), list(state_data.values())]),
+                      create=lambda: sheet.add_worksheet(title="State", rows=2, cols=len(state_data)))
+        st.session_state['_last_state_hash'] = state_hash
+    return True
 
 def load_cloud_state():
     client = get_google_sheet_client()
     if client:
         try:
-            data = client.open_by_url(st.secrets["SHEET_URL"]).worksheet("State").get_all_records()
-            if data: return data[-1]
-        except: return None
+            # Header + the one state row, raw values: no whole-sheet read or per-cell numericise
+            rows = _on_worksheet(_open_sheet(client, st.secrets["SHEET_URL"]), "State", lambda ws: _retry(ws.get, "1:2", value_render_option="UNFORMATTED_VALUE"))
+            if len(rows) == 2:
+                state = dict(zip(rows[0], rows[1]))
+                # Decode the JSON tables here once, so callers get lists straight away
+                for k in ('expenses', 'deductions'):
+                    if k in state: state[k] = orjson.loads(state[k] or '[]')
+                return state
+        except _sheets_errors(): return None
     return None
 
-@st.cache_data(ttl=3600)
+@st.cache_resource(show_spinner=False)
+def get_genai_client(api_key):
+    # One SDK client (and its HTTP connection pool) per key for the whole process
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+@st.cache_data(show_spinner=False, persist="disk")
+def generate_profile(model_name, persona, _api_key):
+    # Keyed on model + persona only; the underscore keeps the API key out of the cache key
+    client = get_genai_client(_api_key)
+    prompt = AUTOFILL_PROMPT_PREFIX + persona + AUTOFILL_PROMPT_SUFFIX
+    response = client.models.generate_content(model=model_name, contents=prompt, config={"response_mime_type": "application/json"})
+    return orjson.loads(response.text)
+
+def audit_config(model_name):
+    # Decode time scales with output length, so cap each section's reply.
+    # Thinking tokens count against max_output_tokens, so every thinking model gets a bounded budget or no cap.
+    cfg = {"temperature": 0.4}
+    if "2.5-flash" in model_name:
+        cfg.update(max_output_tokens=AUDIT_MAX_OUTPUT_TOKENS, thinking_config={"thinking_budget": 0})
+    elif "2.5-pro" in model_name:
+        cfg.update(max_output_tokens=AUDIT_MAX_OUTPUT_TOKENS + AUDIT_PRO_THINKING_BUDGET, thinking_config={"thinking_budget": AUDIT_PRO_THINKING_BUDGET})
+    elif "gemini-3" in model_name:
+        # Thinking can only be turned down here, not bounded by a budget, so leave the reply uncapped
+        cfg["thinking_config"] = {"thinking_level": "low"}
+    elif model_name.startswith(("gemini-1.", "gemini-2.0-")) and "thinking" not in model_name:
+        # Pre-2.5 models don't think, so the whole cap goes to the reply
+        cfg["max_output_tokens"] = AUDIT_MAX_OUTPUT_TOKENS
+    # Anything else (e.g. the gemini-*-latest aliases) may think without a budget we control: no cap
+    return cfg
+
+async def _stream_section(client, model_name, prompt, box):
+    # Re-render the styled box as chunks arrive instead of waiting for the full reply
+    txt = ""
+    async for chunk in await client.models.generate_content_stream(model=model_name, contents=prompt, config=audit_config(model_name)):
+        txt += chunk.text or ""
+        box.markdown(f"""<div class='ai-box'>{txt}</div>""", unsafe_allow_html=True)
+    return txt
+
+async def stream_audit_sections(api_key, model_name, prompts, boxes):
+    # Short-lived async client: its connection pool is tied to this asyncio.run() loop
+    from google import genai
+    async with genai.Client(api_key=api_key).aio as client:
+        return await asyncio.gather(*(_stream_section(client, model_name, p, b) for p, b in zip(prompts, boxes)))
+
+@traced_cache(ttl=3600, show_spinner=False)
+def list_gemini_models(api_key_hash, _api_key):
+    # Keyed on a hash so the key itself never lands in the cache
+    client = get_genai_client(_api_key)
+    return sorted(m.name.replace("models/", "") for m in client.models.list() if "gemini" in m.name and "embedding" not in m.name)
+
+@traced_cache(ttl=3600)
 def get_currency_data(target_currency_code):
+    import yfinance as yf
     try:
         ticker = yf.Ticker(f"MYR{target_currency_code}=X")
-        hist = ticker.history(period="1y")
+        # Only the Close column is charted; caching the full OHLCV frame just costs memory
+        hist = ticker.history(period="1y")[['Close']]
         return hist['Close'].iloc[-1], hist
-    except: return None, None
+    # No quote (empty frame) or a yfinance/network failure
+    except (yf.exceptions.YFException, KeyError, IndexError, OSError): return None, None
+
+def scale_amounts(records, rate):
+    # One vectorised multiply over the column; blank (None) amounts stay blank
+    amounts = np.array([x.get('Amount') for x in records], dtype=np.float64) * rate
+    for x, v in zip(records, amounts.tolist()): x['Amount'] = None if v != v else v
+
+@traced_cache(ttl=3600, show_spinner=False)
+def get_fx_rates(tickers):
+    # Both legs in one yfinance download (fetched concurrently); a missing quote raises, so it isn't cached
+    import yfinance as yf
+    close = yf.download(list(tickers), period="5d", progress=False, auto_adjust=False)['Close'].ffill()
+    rates = tuple(float(close[t].iloc[-1]) for t in tickers)
+    if not all(r > 0 for r in rates): raise ValueError("Rate Error")
+    return rates
 
 def perform_currency_switch(target_currency):
     current_currency = st.session_state.active_currency
     if current_currency == target_currency: return
-    
-    rate = 1.0
-    # Normalize to MYR
-    if current_currency != "MYR":
-        try:
-            data = yf.Ticker(f"{current_currency}MYR=X").history(period="1d")
-            if not data.empty:
-                to_myr = data['Close'].iloc[-1]
-                st.session_state.basic_salary *= to_myr
-                st.session_state.allowances *= to_myr
-                st.session_state.variable_income *= to_myr
-                st.session_state.current_savings *= to_myr
-                for x in st.session_state.expenses: x['Amount'] *= to_myr
-                for x in st.session_state.deductions_list: x['Amount'] *= to_myr
-            else: st.error("Rate Error"); return
-        except: st.error("API Error"); return
-
-    # Convert to Target
-    if target_currency != "MYR":
-        try:
-            data = yf.Ticker(f"MYR{target_currency}=X").history(period="1d")
-            if not data.empty:
-                to_target = data['Close'].iloc[-1]
-                st.session_state.basic_salary *= to_target
-                st.session_state.allowances *= to_target
-                st.session_state.variable_income *= to_target
-                st.session_state.current_savings *= to_target
-                for x in st.session_state.expenses: x['Amount'] *= to_target
-                for x in st.session_state.deductions_list: x['Amount'] *= to_target
-            else: st.error("Rate Error"); return
-        except: st.error("API Error"); return
-
-    st.session_state.loaded_salary = st.session_state.basic_salary
-    st.session_state.loaded_allowances = st.session_state.allowances
-    st.session_state.loaded_var = st.session_state.variable_income
-    st.session_state.loaded_savings = st.session_state.current_savings
-    st.session_state.active_currency = target_currency
+
+    # Via MYR: CUR->MYR then MYR->TARGET, folded into one multiplier
+    tickers = tuple(t for t, needed in ((f"{current_currency}MYR=X", current_currency != "MYR"), (f"MYR{target_currency}=X", target_currency != "MYR")) if needed)
+    from yfinance.exceptions import YFException
+    try: rate = float(np.prod(get_fx_rates(tickers)))
+    except (ValueError, KeyError, IndexError): st.error("Rate Error"); return
+    except (YFException, OSError): st.error("API Error"); return
+
+    # Parity (e.g. a round trip through MYR) only relabels the currency
+    if abs(rate - 1.0) > 1e-9:
+        st.session_state.basic_salary *= rate
+        st.session_state.allowances *= rate
+        st.session_state.variable_income *= rate
+        st.session_state.current_savings *= rate
+        scale_amounts(st.session_state.expenses, rate)
+        scale_amounts(st.session_state.deductions_list, rate)
+
+    st.session_state.update({
+        "loaded_salary": st.session_state.basic_salary, "loaded_allowances": st.session_state.allowances,
+        "loaded_var": st.session_state.variable_income, "loaded_savings": st.session_state.current_savings,
+        "active_currency": target_currency,
+    })
     st.rerun()
 
+# --- CHART BUILDERS ---
+# Cached on their inputs so unrelated widget changes reuse the last figure
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_spending_pie(categories, amounts):
+    import plotly.express as px
+    fig = px.pie(values=list(amounts), names=list(categories), hole=0.6, title="Spending Breakdown")
+    fig.update_layout(height=300, margin=dict(t=30, b=0, l=0, r=0))
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_projection_chart(current_savings, balance, months_to_project, yearly_rates):
+    month_nums = np.arange(1, months_to_project + 1)
+    # Years past the edited table fall back to 3% (the appended last slot)
+    year_idx = np.minimum((month_nums - 1) // 12, len(yearly_rates))
+    monthly_factor = 1 + np.append(np.asarray(yearly_rates, dtype=float), 0.03) / 12
+    # Closed form per month: whole earlier years compounded (O(years)), then this year's factor ** months so far
+    full_years = np.concatenate(([1.0], np.cumprod(monthly_factor[:-1] ** 12)))
+    cumulative_deflator = full_years[year_idx] * monthly_factor[year_idx] ** (month_nums - 12 * year_idx)
+    # float32 is plenty for display and halves the series the chart ships to the browser
+    nominal = (current_savings + balance * month_nums).astype(np.float32)
+    real = (nominal / cumulative_deflator).astype(np.float32)
+
+    # Two traces straight from the arrays: no melted long frame for px to split back apart
+    import plotly.graph_objects as go
+    fig = go.Figure([
+        go.Scatter(x=month_nums, y=nominal, name="Nominal Wealth", mode="lines", line=dict(color="#2ecc71"), fill="tozeroy"),
+        go.Scatter(x=month_nums, y=real, name="Real Purchasing Power", mode="lines", line=dict(color="#e74c3c")),
+    ])
+    fig.update_layout(height=300, margin=dict(t=10, b=0, l=0, r=0), legend=dict(orientation="h", y=1.1, title=None), xaxis_title="Month", yaxis_title="Amount")
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_rate_chart(dates, closes):
+    import plotly.graph_objects as go
+    fig = go.Figure(go.Scatter(x=dates, y=closes, mode="lines"))
+    fig.update_layout(height=200, margin=dict(t=10, b=0, l=0, r=0), yaxis_title=None, xaxis_title=None)
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_history_chart(dates, net_income, balance):
+    # Plain stacked-area traces: same look as px.area without its melt/validation pass
+    import plotly.graph_objects as go
+    fig = go.Figure([
+        go.Scatter(x=dates, y=net_income, name="Net_Income", mode="lines+markers", stackgroup="one"),
+        go.Scatter(x=dates, y=balance, name="Balance", mode="lines+markers", stackgroup="one"),
+    ])
+    fig.update_layout(height=200, legend_title_text="variable", xaxis_title="Date", yaxis_title="value")
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_history_chart_html(dates, net_income, balance):
+    # Pre-rendered fragment: reruns resend a cached string instead of re-serialising the figure
+    return build_history_chart(dates, net_income, balance).to_html(include_plotlyjs="cdn", full_html=False, default_height=200)
+
 # --- INITIALIZATION ---
 if 'data_loaded' not in st.session_state:
-    cloud_state = load_cloud_state()
-    defaults = get_default_state()
-    if cloud_state:
-        st.session_state.expenses = json.loads(cloud_state.get('expenses', json.dumps(defaults['expenses'])))
-        st.session_state.deductions_list = json.loads(cloud_state.get('deductions', json.dumps(defaults['deductions'])))
-        st.session_state.loaded_salary = float(cloud_state.get('basic_salary', defaults['basic_salary']))
-        st.session_state.loaded_allowances = float(cloud_state.get('allowances', defaults['allowances']))
-        st.session_state.loaded_var = float(cloud_state.get('variable_income', defaults['variable_income']))
-        st.session_state.loaded_savings = float(cloud_state.get('current_savings', defaults['current_savings']))
-        st.session_state.loaded_epf = int(cloud_state.get('epf_rate', defaults['epf_rate']))
-        st.session_state.loaded_month = cloud_state.get('month_select', "December")
-        st.session_state.loaded_year = int(cloud_state.get('year_input', datetime.now().year))
-        st.session_state.active_currency = cloud_state.get('currency', "MYR")
-    else:
-        for k, v in defaults.items(): st.session_state[k] = v 
-        st.session_state.deductions_list = defaults['deductions']
-        st.session_state.loaded_salary = defaults['basic_salary']
-        st.session_state.loaded_allowances = defaults['allowances']
-        st.session_state.loaded_var = defaults['variable_income']
-        st.session_state.loaded_savings = defaults['current_savings']
-        st.session_state.loaded_epf = defaults['epf_rate']
-        st.session_state.loaded_month = "December"
-        st.session_state.loaded_year = datetime.now().year
-        st.session_state.active_currency = "MYR"
-    
-    st.session_state.last_viewed_month = st.session_state.loaded_month
-    st.session_state.last_viewed_year = st.session_state.loaded_year
-    st.session_state.data_loaded = True
+    # No cloud state -> the schema fallbacks, i.e. the built-in defaults
+    init = cloud_state_values(load_cloud_state() or {})
+    # Only the loaded_* defaults here; the widgets pick them up via value= on first render
+    st.session_state.update({
+        "expenses": init['expenses'], "deductions_list": init['deductions_list'], "active_currency": init['active_currency'],
+        "loaded_salary": init['basic_salary'], "loaded_allowances": init['allowances'], "loaded_var": init['variable_income'],
+        "loaded_savings": init['current_savings'], "loaded_epf": init['epf_rate'],
+        "loaded_month": init['month_select'], "loaded_year": init['year_input'],
+        "last_viewed_month": init['month_select'], "last_viewed_year": init['year_input'],
+        "data_loaded": True,
+    })
 
 # Safety Checks
-if 'last_viewed_month' not in st.session_state: st.session_state.last_viewed_month = st.session_state.get('loaded_month', "December")
-if 'last_viewed_year' not in st.session_state: st.session_state.last_viewed_year = st.session_state.get('loaded_year', datetime.now().year)
-if 'available_models' not in st.session_state: st.session_state.available_models = ["gemini-1.5-flash", "gemini-2.0-flash-exp"]
+st.session_state.setdefault('last_viewed_month', st.session_state.get('loaded_month', "December"))
+st.session_state.setdefault('last_viewed_year', st.session_state.get('loaded_year', CURRENT_YEAR))
+st.session_state.setdefault('available_models', ["gemini-1.5-flash", "gemini-2.0-flash-exp"])
 
 # --- SIDEBAR LOGIC (Continuation) ---
 with st.sidebar:
@@ -348,32 +710,17 @@ with st.sidebar:
     c1, c2 = st.columns(2)
     with c1:
         if st.button("⬆️ Upload"):
-            with st.spinner("Syncing..."): save_cloud_state(); st.success("Uploaded!")
+            with st.spinner("Syncing..."): uploaded = save_cloud_state()
+            if uploaded: st.success("Uploaded!")
+            else: st.toast("No changes to sync")
     with c2:
         if st.button("⬇️ Pull"):
             with st.spinner("Downloading..."):
                 cs = load_cloud_state()
                 if cs:
-                    st.session_state["basic_salary"] = float(cs.get('basic_salary', 0))
-                    st.session_state["allowances"] = float(cs.get('allowances', 0))
-                    st.session_state["variable_income"] = float(cs.get('variable_income', 0))
-                    st.session_state["current_savings"] = float(cs.get('current_savings', 0))
-                    st.session_state["epf_rate"] = int(cs.get('epf_rate', 11))
-                    st.session_state["month_select"] = cs.get('month_select', "December")
-                    st.session_state["year_input"] = int(cs.get('year_input', datetime.now().year))
-                    st.session_state.expenses = json.loads(cs.get('expenses', '[]'))
-                    st.session_state.deductions_list = json.loads(cs.get('deductions', '[]'))
-                    st.session_state["active_currency"] = cs.get('currency', "MYR")
-                    
-                    st.session_state.loaded_salary = st.session_state["basic_salary"]
-                    st.session_state.loaded_allowances = st.session_state["allowances"]
-                    st.session_state.loaded_var = st.session_state["variable_income"]
-                    st.session_state.loaded_savings = st.session_state["current_savings"]
-                    st.session_state.loaded_epf = st.session_state["epf_rate"]
-                    st.session_state.loaded_month = st.session_state["month_select"]
-                    st.session_state.loaded_year = st.session_state["year_input"]
-                    st.session_state.last_viewed_month = st.session_state["month_select"]
-                    st.session_state.last_viewed_year = st.session_state["year_input"]
+                    pulled = cloud_state_values(cs)
+                    month, year = pulled['month_select'], pulled['year_input']
+                    apply_loaded_values(pulled, loaded_month=month, loaded_year=year, last_viewed_month=month, last_viewed_year=year)
                     st.rerun()
             st.success("Updated!")
 
@@ -386,24 +733,13 @@ with st.sidebar:
             else:
                 with st.spinner("Generating..."):
                     try:
-                        client = genai.Client(api_key=api_key)
-                        prompt = f"""You are a Data Entry API. Persona: "{user_persona}". Return JSON: {{"basic_salary": float, "allowances": float, "variable_income": float, "current_savings": float, "epf_rate": int, "expenses": [{{"Category":str,"Amount":float}}], "deductions": [{{"Category":str,"Amount":float}}]}}"""
-                        response = client.models.generate_content(model=selected_fill_model, contents=prompt)
-                        ai_data = json.loads(response.text.replace("```json", "").replace("```", "").strip())
+                        ai_data = generate_profile(selected_fill_model, user_persona, api_key)
                         
-                        st.session_state["basic_salary"] = float(ai_data.get("basic_salary", 0))
-                        st.session_state["allowances"] = float(ai_data.get("allowances", 0))
-                        st.session_state["variable_income"] = float(ai_data.get("variable_income", 0))
-                        st.session_state["current_savings"] = float(ai_data.get("current_savings", 0))
-                        st.session_state["epf_rate"] = int(ai_data.get("epf_rate", 11))
-                        st.session_state.expenses = ai_data.get("expenses", [])
-                        st.session_state.deductions_list = ai_data.get("deductions", [])
-                        
-                        st.session_state.loaded_salary = st.session_state["basic_salary"]
-                        st.session_state.loaded_allowances = st.session_state["allowances"]
-                        st.session_state.loaded_var = st.session_state["variable_income"]
-                        st.session_state.loaded_savings = st.session_state["current_savings"]
-                        st.session_state.loaded_epf = st.session_state["epf_rate"]
+                        apply_loaded_values({
+                            "basic_salary": float(ai_data.get("basic_salary", 0)), "allowances": float(ai_data.get("allowances", 0)),
+                            "variable_income": float(ai_data.get("variable_income", 0)), "current_savings": float(ai_data.get("current_savings", 0)),
+                            "epf_rate": int(ai_data.get("epf_rate", 11)), "expenses": ai_data.get("expenses", []), "deductions_list": ai_data.get("deductions", []),
+                        })
                         st.rerun()
                     except Exception as e: st.error(f"Error: {e}")
 
@@ -412,10 +748,130 @@ with st.sidebar:
         if not api_key: st.error("API Key required.")
         else:
             try:
-                client = genai.Client(api_key=api_key)
-                models = client.models.list()
-                fetched = [m.name.replace("models/", "") for m in models if "gemini" in m.name and "embedding" not in m.name]
-                if fetched: st.session_state.available_models = sorted(fetched); st.success(f"Found {len(fetched)} models!")
+                fetched = list_gemini_models(hashlib.sha256(api_key.encode()).hexdigest(), api_key)
+                if fetched: st.session_state.available_models = fetched; st.success(f"Found {len(fetched)} models!")
+            except Exception as e: st.error(f"Error: {e}")
+
+# --- WEALTH PROJECTION ---
+# Fragment: duration and inflation edits redraw only the projection
+@st.fragment
+def wealth_projection(current_savings, balance):
+    t_col1, t_col2 = st.columns([3, 1])
+    t_col1.subheader("📈 Wealth Projection")
+    duration_option = t_col2.selectbox("Duration", list(DURATION_MONTHS), index=1)
+    months_to_project = DURATION_MONTHS[duration_option]
+    years_count = months_to_project // 12
+    
+    t_col2.caption("Inflation %")
+    default_rates = [{"Year": i+1, "Inflation": 3.0} for i in range(years_count)]
+    # Records in, records out (like the expense editors): no DataFrame built just to feed the grid
+    edited_rates = t_col2.data_editor(default_rates, hide_index=True, use_container_width=True, column_config={"Inflation": st.column_config.NumberColumn(format="%.1f")})
+    yearly_rates = np.array([r.get("Inflation") for r in edited_rates], dtype=np.float64) / 100
+
+    fig2 = build_projection_chart(current_savings, balance, months_to_project, tuple(yearly_rates.tolist()))
+    t_col1.plotly_chart(fig2, use_container_width=True)
+
+# --- CLOUD DATABASE ---
+# Fragment: save, delete and the trend toggle redraw only this block; load reruns the app
+@st.fragment
+def cloud_database(curr, selected_month, selected_year, net, total_exp, balance, epf_amount,
+                   basic_salary, allowances, variable_income, current_savings, epf_rate):
+    st.subheader("☁️ Cloud Database")
+    # Callbacks queue their outcome here: elements drawn from a callback during a fragment rerun can land at the top of the app
+    toast = st.session_state.pop('_db_toast', None)
+    if toast: st.toast(toast[0], icon=toast[1])
+    db_col1, db_col2 = st.columns(2)
+    
+    with db_col1:
+        if st.button(f"Save Record ({selected_month})", type="primary"):
+            # Built only on Save: the JSON dumps and date stay off ordinary reruns
+            current_data = {
+                "Date": f"{selected_year:04d}-{MONTH_INDEX[selected_month]+1:02d}-01",
+                "Month": selected_month, "Year": selected_year, "Net_Income": net, "Total_Expenses": total_exp, 
+                "Balance": balance, "EPF_Savings": epf_amount, "Basic_Salary": basic_salary, 
+                "Allowances": allowances, "Variable_Income": variable_income, "Current_Savings": current_savings, 
+                "EPF_Rate": epf_rate, "Expenses_JSON": records_to_json(st.session_state.expenses), 
+                "Deductions_JSON": records_to_json(st.session_state.deductions_list), "Currency": curr 
+            }
+            with st.spinner("Saving..."):
+                saved = save_row_to_history(current_data)
+            # No st.rerun(): the click already reruns this fragment, and the list below
+            # re-reads History now that the save cleared its cache
+            st.session_state.last_viewed_month = selected_month
+            if saved: st.success("Saved!")
+            else: st.toast("No changes to sync")
+
+    st.divider()
+    df_hist = load_history_df()
+    if not df_hist.empty and 'Month' in df_hist.columns and 'Year' in df_hist.columns:
+        _, history_by_label = load_history_index()
+        record_labels = list(history_by_label)
+        c_load, c_del = st.columns(2)
+        
+        with c_load:
+            record_to_load = st.selectbox("Select Record", record_labels, index=None, placeholder="Load past data...", key="loader_box")
+            def load_record_callback():
+                record_label = st.session_state.loader_box
+                if record_label:
+                    row = load_history_index()[1][record_label]
+                    month, year = row['Month'], int(row['Year'])
+                    apply_loaded_values(history_row_values(row), month_select=month, year_input=year, loaded_month=month,
+                                        loaded_year=year, last_viewed_month=month, last_viewed_year=year)
+                    st.session_state['_db_toast'] = (f"Jumped to {record_label}!", "🚀")
+            # The callback refills every input on the page, so step out of the fragment
+            if st.button("Load Record", on_click=load_record_callback) and record_to_load: st.rerun()
+
+        with c_del:
+            st.multiselect("Select Record", record_labels, key="deleter_box", label_visibility="hidden")
+            # Runs before the rerun the click triggers, so the page redraws once with the rows gone
+            def delete_records_callback():
+                to_delete = st.session_state.deleter_box
+                if to_delete:
+                    delete_rows_from_sheet("History", to_delete)
+                    clear_history_cache()
+                    st.session_state.deleter_box = []
+                    st.session_state['_db_toast'] = (f"Deleted {len(to_delete)} record(s)!", "🗑️")
+            st.button("Delete Selected", on_click=delete_records_callback)
+
+        # Trend is opt-in so reruns elsewhere on the page skip building it
+        if 'Date' in df_hist.columns and st.checkbox("📈 Show history trend", key="show_history_trend"):
+            trend = load_history_trend()
+            if trend is not None:
+                hist_html = build_history_chart_html(*(trend[c].to_numpy() for c in trend.column_names))
+                components.html(hist_html, height=210)
+    else:
+        st.info("No history found.")
+
+# --- AI AUDITOR ---
+# Fragment: the model picker and Analyze button rerun only this panel, not the whole page
+@st.fragment
+def auditor_panel(curr, net, total_exp, balance, epf_amount, selected_month, selected_year):
+    st.markdown("""<div class='ai-box'><h3>🤖 AI Financial Auditor</h3></div>""", unsafe_allow_html=True)
+    selected_auditor_model = st.selectbox("Select Model", st.session_state.available_models, key="auditor_model_select")
+    if st.button("🚀 Analyze Portfolio", type="primary"):
+        if not api_key: st.warning("API Key required.")
+        else:
+            try:
+                line_items = itemgetter('Category', 'Amount')
+                deductions = tuple(map(line_items, st.session_state.deductions_list))
+                expenses = tuple(map(line_items, st.session_state.expenses))
+                # Plain tuple fingerprint: a repeat click replays the earlier analysis before any prompt is built
+                audit_key = (selected_auditor_model, curr, selected_month, selected_year, round(net, 2), round(total_exp, 2),
+                             round(balance, 2), round(epf_amount, 2), deductions, expenses)
+                audit_cache = st.session_state.setdefault('audit_cache', {})
+                if audit_key in audit_cache:
+                    for section_txt in audit_cache[audit_key]:
+                        st.markdown(f"""<div class='ai-box'>{section_txt}</div>""", unsafe_allow_html=True)
+                else:
+                    deduction_txt = "\n".join(f"- {c}: {curr} {a}" for c, a in deductions)
+                    exp_txt = "\n".join(f"- {c}: {curr} {a}" for c, a in expenses)
+                    audit_header = AUDIT_HEADER.substitute(month=selected_month, year=selected_year, curr=curr, net=f"{net:.2f}", exp=f"{total_exp:.2f}",
+                                                           bal=f"{balance:.2f}", epf=f"{epf_amount:.2f}", deductions=deduction_txt, expenses=exp_txt)
+                    # One shorter prompt per section, sharing the same header, decoded in parallel
+                    prompts = [f"{audit_header}\nProvide: {section}." for section in AUDIT_SECTIONS]
+                    with st.spinner(f"AI is analyzing your finances..."):
+                        boxes = [st.empty() for _ in prompts]
+                        audit_cache[audit_key] = asyncio.run(stream_audit_sections(api_key, selected_auditor_model, prompts, boxes))
             except Exception as e: st.error(f"Error: {e}")
 
 # --- MAIN LAYOUT ---
@@ -432,52 +888,28 @@ with col_left:
     with st.container():
         st.subheader(f"📅 Period & Income ({curr})")
         d_col1, d_col2 = st.columns(2)
-        months = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
-        
-        try: def_idx = months.index(st.session_state.loaded_month)
-        except: def_idx = 0
+        def_idx = MONTH_INDEX.get(st.session_state.loaded_month, 0)
         
-        selected_month = d_col1.selectbox("Month", months, index=def_idx, key="month_select")
+        selected_month = d_col1.selectbox("Month", MONTHS, index=def_idx, key="month_select")
         selected_year = d_col2.number_input("Year", min_value=2020, max_value=2030, value=st.session_state.loaded_year, key="year_input")
         
         if (selected_month != st.session_state.last_viewed_month) or (selected_year != st.session_state.last_viewed_year):
             with st.spinner(f"Syncing records..."):
-                df_history = get_sheet_data("History")
-                found = None
-                if not df_history.empty and 'Month' in df_history.columns and 'Year' in df_history.columns:
-                     mask = (df_history['Month'] == selected_month) & (df_history['Year'] == selected_year)
-                     if mask.any(): found = df_history[mask].iloc[0]
+                history_by_period, _ = load_history_index()
+                found = history_by_period.get((selected_month, str(selected_year)))
                 
                 if found is not None and 'Expenses_JSON' in found:
-                    st.session_state["basic_salary"] = float(found.get('Basic_Salary', 0))
-                    st.session_state["allowances"] = float(found.get('Allowances', 0))
-                    st.session_state["variable_income"] = float(found.get('Variable_Income', 0))
-                    st.session_state["current_savings"] = float(found.get('Current_Savings', 0))
-                    st.session_state["epf_rate"] = int(found.get('EPF_Rate', 11))
-                    st.session_state.expenses = json.loads(found.get('Expenses_JSON', '[]'))
-                    st.session_state.deductions_list = json.loads(found.get('Deductions_JSON', '[]'))
-                    st.session_state["active_currency"] = found.get('Currency', "MYR")
+                    values = history_row_values(found)
                     st.toast(f"Data Loaded: {selected_month} {selected_year}", icon="✅")
                 else:
                     defaults = get_default_state()
-                    st.session_state["basic_salary"] = defaults['basic_salary']
-                    st.session_state["allowances"] = defaults['allowances']
-                    st.session_state["variable_income"] = defaults['variable_income']
-                    st.session_state["current_savings"] = defaults['current_savings']
-                    st.session_state["epf_rate"] = defaults['epf_rate']
-                    st.session_state.expenses = defaults['expenses']
-                    st.session_state.deductions_list = defaults['deductions']
-                    st.session_state["active_currency"] = "MYR"
+                    values = {k: defaults[k] for k in ("basic_salary", "allowances", "variable_income", "current_savings", "epf_rate", "expenses")}
+                    values.update(deductions_list=defaults['deductions'], active_currency=defaults['currency'])
                     st.toast(f"New Period: {selected_month} {selected_year}", icon="✨")
-
-                st.session_state.loaded_salary = st.session_state["basic_salary"]
-                st.session_state.loaded_allowances = st.session_state["allowances"]
-                st.session_state.loaded_var = st.session_state["variable_income"]
-                st.session_state.loaded_savings = st.session_state["current_savings"]
-                st.session_state.loaded_epf = st.session_state["epf_rate"]
-                st.session_state.last_viewed_month = selected_month
-                st.session_state.last_viewed_year = selected_year
-                st.rerun()
+                apply_loaded_values(values, last_viewed_month=selected_month, last_viewed_year=selected_year)
+                # Inputs below read the new values this run; only a currency change
+                # needs a full rerun to relabel what's already been drawn
+                if st.session_state.active_currency != curr: st.rerun()
 
         st.divider()
         current_savings = st.number_input(f"Current Savings ({curr})", value=st.session_state.loaded_savings, step=1000.0, key="current_savings")
@@ -496,10 +928,9 @@ with col_left:
         epf_amount = (basic_salary + allowances) * (epf_rate / 100)
         st.info(f"EPF Contribution: {curr} {epf_amount:,.2f}")
         
-        df_deductions_input = pd.DataFrame(st.session_state.deductions_list)
-        edited_deductions = st.data_editor(df_deductions_input, num_rows="dynamic", use_container_width=True, key="deductions_editor", column_config={"Category": st.column_config.TextColumn("Deduction Name"), "Amount": st.column_config.NumberColumn(f"Amount ({curr})", format="%.2f")})
-        st.session_state.deductions_list = edited_deductions.to_dict('records')
-        total_deductions = epf_amount + (edited_deductions['Amount'].sum() if not edited_deductions.empty else 0)
+        edited_deductions = st.data_editor(st.session_state.deductions_list, num_rows="dynamic", use_container_width=True, key="deductions_editor", column_config={"Category": st.column_config.TextColumn("Deduction Name"), "Amount": st.column_config.NumberColumn(f"Amount ({curr})", format="%.2f")})
+        st.session_state.deductions_list = edited_deductions
+        total_deductions = epf_amount + total_amount(edited_deductions)
         st.markdown(f"<div class='total-badge badge-red'>Total Deducted: {curr} {total_deductions:,.2f}</div>", unsafe_allow_html=True)
 
     # --- EXPENSES ---
@@ -524,8 +955,9 @@ with col_left:
                 else:
                     with st.spinner("Analyzing Receipt..."):
                         try:
+                            from PIL import Image
                             image = Image.open(target_img)
-                            client = genai.Client(api_key=api_key)
+                            client = get_genai_client(api_key)
                             prompt = f"""
                             Analyze this receipt image. Identify the purchased items or the total amount.
                             The user's dashboard currency is {curr}.
@@ -534,12 +966,13 @@ with col_left:
                             - 'Amount' must be a number (float).
                             """
                             # USE SELECTED MODEL
+                            # JSON mode: the reply is bare JSON, so no fence stripping before parsing
                             response = client.models.generate_content(
                                 model=rec_model_name, 
-                                contents=[prompt, image]
+                                contents=[prompt, image],
+                                config={"response_mime_type": "application/json"}
                             )
-                            raw_txt = response.text.replace("```json", "").replace("```", "").strip()
-                            new_items = json.loads(raw_txt)
+                            new_items = orjson.loads(response.text)
                             
                             if isinstance(new_items, list):
                                 st.session_state.expenses.extend(new_items)
@@ -549,16 +982,14 @@ with col_left:
                         except Exception as e: st.error(f"Error processing receipt: {e}")
 
         # --- EXISTING TABLE ---
-        df_expenses_input = pd.DataFrame(st.session_state.expenses)
-        edited_expenses = st.data_editor(df_expenses_input, num_rows="dynamic", use_container_width=True, key="expenses_editor", column_config={"Category": st.column_config.TextColumn("Expense Category"), "Amount": st.column_config.NumberColumn(f"Amount ({curr})", format="%.2f")})
-        st.session_state.expenses = edited_expenses.to_dict('records')
-        total_living_expenses = edited_expenses['Amount'].sum() if not edited_expenses.empty else 0.0
+        edited_expenses = st.data_editor(st.session_state.expenses, num_rows="dynamic", use_container_width=True, key="expenses_editor", column_config={"Category": st.column_config.TextColumn("Expense Category"), "Amount": st.column_config.NumberColumn(f"Amount ({curr})", format="%.2f")})
+        st.session_state.expenses = edited_expenses
+        total_living_expenses = total_amount(edited_expenses)
         st.markdown(f"<div class='total-badge badge-blue'>Total Expenses: {curr} {total_living_expenses:,.2f}</div>", unsafe_allow_html=True)
 
 with col_right:
-    gross = basic_salary + allowances + variable_income
-    net = gross - total_deductions
-    total_exp = edited_expenses['Amount'].sum() if not edited_expenses.empty else 0
+    net = total_gross - total_deductions
+    total_exp = total_living_expenses
     balance = net - total_exp
 
     # --- SNAPSHOT ---
@@ -574,136 +1005,28 @@ with col_right:
             rate, hist = get_currency_data(curr)
             if rate:
                 st.caption(f"1 MYR = {rate:.4f} {curr}")
-                fig_rate = px.line(hist, y="Close", height=200)
-                fig_rate.update_layout(margin=dict(t=10, b=0, l=0, r=0), yaxis_title=None, xaxis_title=None)
+                fig_rate = build_rate_chart(hist.index.tz_localize(None).to_numpy(), hist['Close'].to_numpy())
                 st.plotly_chart(fig_rate, use_container_width=True)
             else: st.warning("Chart unavailable")
 
     with st.container():
-        if not edited_expenses.empty:
-            fig = px.pie(edited_expenses, values='Amount', names='Category', hole=0.6, title="Spending Breakdown")
-            fig.update_layout(height=300, margin=dict(t=30, b=0, l=0, r=0))
+        if edited_expenses:
+            fig = build_spending_pie(tuple(d.get('Category') for d in edited_expenses), tuple(d.get('Amount') for d in edited_expenses))
             st.plotly_chart(fig, use_container_width=True)
 
     with st.container():
-        t_col1, t_col2 = st.columns([3, 1])
-        t_col1.subheader("📈 Wealth Projection")
-        duration_option = t_col2.selectbox("Duration", ["1 Year", "3 Years", "5 Years", "10 Years"], index=1)
-        duration_map = {"1 Year": 12, "3 Years": 36, "5 Years": 60, "10 Years": 120}
-        months_to_project = duration_map[duration_option]
-        years_count = months_to_project // 12
-        
-        t_col2.caption("Inflation %")
-        default_rates = [{"Year": i+1, "Inflation": 3.0} for i in range(years_count)]
-        edited_rates = t_col2.data_editor(pd.DataFrame(default_rates), hide_index=True, use_container_width=True, column_config={"Inflation": st.column_config.NumberColumn(format="%.1f")})
-        yearly_rates_list = [x / 100 for x in edited_rates["Inflation"].tolist()]
-
-        future = []
-        acc = current_savings
-        cumulative_deflator = 1.0 
-        for m in range(months_to_project):
-            current_year_idx = m // 12
-            rate = yearly_rates_list[current_year_idx] if current_year_idx < len(yearly_rates_list) else 0.03
-            monthly_inflation = rate / 12
-            acc += balance
-            cumulative_deflator *= (1 + monthly_inflation)
-            future.append({"Month": m+1, "Nominal Wealth": acc, "Real Purchasing Power": acc / cumulative_deflator})
-        
-        df_future = pd.DataFrame(future).melt(id_vars=["Month"], var_name="Metric", value_name="Amount")
-        fig2 = px.line(df_future, x="Month", y="Amount", color="Metric", color_discrete_map={"Nominal Wealth": "#2ecc71", "Real Purchasing Power": "#e74c3c"})
-        fig2.update_traces(fill='tozeroy', selector=dict(name="Nominal Wealth"))
-        fig2.update_layout(height=300, margin=dict(t=10, b=0, l=0, r=0), legend=dict(orientation="h", y=1.1, title=None))
-        t_col1.plotly_chart(fig2, use_container_width=True)
+        wealth_projection(float(current_savings), float(balance))
 
     with st.container():
-        st.subheader("☁️ Cloud Database")
-        db_col1, db_col2 = st.columns(2)
-        
-        current_data = {
-            "Date": datetime(selected_year, months.index(selected_month)+1, 1).strftime("%Y-%m-%d"),
-            "Month": selected_month, "Year": selected_year, "Net_Income": net, "Total_Expenses": total_exp, 
-            "Balance": balance, "EPF_Savings": epf_amount, "Basic_Salary": basic_salary, 
-            "Allowances": allowances, "Variable_Income": variable_income, "Current_Savings": current_savings, 
-            "EPF_Rate": epf_rate, "Expenses_JSON": json.dumps(st.session_state.expenses), 
-            "Deductions_JSON": json.dumps(st.session_state.deductions_list), "Currency": curr 
-        }
-        
-        with db_col1:
-            if st.button(f"Save Record ({selected_month})", type="primary"):
-                with st.spinner("Saving..."):
-                    save_row_to_history(current_data)
-                    st.success("Saved!")
-                    st.session_state.last_viewed_month = selected_month
-                    st.rerun()
-
-        st.divider()
-        df_hist = get_sheet_data("History")
-        if not df_hist.empty and 'Month' in df_hist.columns and 'Year' in df_hist.columns:
-            df_hist['Label'] = df_hist['Month'] + " " + df_hist['Year'].astype(str)
-            c_load, c_del = st.columns(2)
-            
-            with c_load:
-                record_to_load = st.selectbox("Select Record", df_hist['Label'].unique(), index=None, placeholder="Load past data...", key="loader_box")
-                def load_record_callback():
-                    record_label = st.session_state.loader_box
-                    if record_label:
-                        df = get_sheet_data("History")
-                        df['Label'] = df['Month'] + " " + df['Year'].astype(str)
-                        row = df[df['Label'] == record_label].iloc[0]
-                        st.session_state["month_select"] = row['Month']
-                        st.session_state["year_input"] = int(row['Year'])
-                        st.session_state["basic_salary"] = float(row.get('Basic_Salary', 0))
-                        st.session_state["allowances"] = float(row.get('Allowances', 0))
-                        st.session_state["variable_income"] = float(row.get('Variable_Income', 0))
-                        st.session_state["current_savings"] = float(row.get('Current_Savings', 0))
-                        st.session_state["epf_rate"] = int(row.get('EPF_Rate', 11))
-                        st.session_state.expenses = json.loads(row.get('Expenses_JSON', '[]'))
-                        st.session_state.deductions_list = json.loads(row.get('Deductions_JSON', '[]'))
-                        st.session_state["active_currency"] = row.get('Currency', "MYR")
-                        st.session_state.loaded_month = row['Month']
-                        st.session_state.loaded_year = int(row['Year'])
-                        st.session_state.loaded_salary = float(row.get('Basic_Salary', 0))
-                        st.session_state.loaded_allowances = float(row.get('Allowances', 0))
-                        st.session_state.loaded_var = float(row.get('Variable_Income', 0))
-                        st.session_state.loaded_savings = float(row.get('Current_Savings', 0))
-                        st.session_state.loaded_epf = int(row.get('EPF_Rate', 11))
-                        st.session_state.last_viewed_month = row['Month']
-                        st.session_state.last_viewed_year = int(row['Year'])
-                        st.toast(f"Jumped to {record_label}!", icon="🚀")
-                st.button("Load Record", on_click=load_record_callback)
-
-            with c_del:
-                to_delete = st.multiselect("Select Record", df_hist['Label'].unique(), key="deleter_box", label_visibility="hidden")
-                if st.button("Delete Selected"):
-                    if to_delete:
-                        delete_rows_from_sheet("History", to_delete)
-                        st.success("Deleted!")
-                        st.rerun()
-
-            if 'Date' in df_hist.columns:
-                df_hist['Date'] = pd.to_datetime(df_hist['Date'])
-                fig_hist = px.area(df_hist.sort_values('Date'), x='Date', y=['Net_Income', 'Balance'], markers=True, height=200)
-                st.plotly_chart(fig_hist, use_container_width=True)
-        else:
-            st.info("No history found.")
+        cloud_database(curr, selected_month, selected_year, net, total_exp, balance, epf_amount,
+                       basic_salary, allowances, variable_income, current_savings, epf_rate)
 
     st.markdown("###")
     with st.container():
-        st.markdown("""<div class='ai-box'><h3>🤖 AI Financial Auditor</h3></div>""", unsafe_allow_html=True)
-        selected_auditor_model = st.selectbox("Select Model", st.session_state.available_models, key="auditor_model_select")
-        if st.button("🚀 Analyze Portfolio", type="primary"):
-            if not api_key: st.warning("API Key required.")
-            else:
-                try:
-                    client = genai.Client(api_key=api_key)
-                    deduction_txt = "\n".join([f"- {x['Category']}: {curr} {x['Amount']}" for x in st.session_state.deductions_list])
-                    exp_txt = "\n".join([f"- {x['Category']}: {curr} {x['Amount']}" for x in st.session_state.expenses])
-                    prompt = f"""Role: Expert Financial Planner. Context: {selected_month} {selected_year}.
-                    Stats: Net: {curr} {net:.2f}, Exp: {curr} {total_exp:.2f}, Bal: {curr} {balance:.2f}.
-                    Deductions: EPF: {curr} {epf_amount:.2f}\n{deduction_txt}
-                    Expenses: {exp_txt}
-                    Provide: 1. Leakage Check 2. Tax Reliefs 3. Strategic Advice."""
-                    with st.spinner(f"AI is analyzing your finances..."):
-                        response = client.models.generate_content(model=selected_auditor_model, contents=prompt)
-                        st.markdown(f"""<div class='ai-box'>{response.text}</div>""", unsafe_allow_html=True)
-                except Exception as e: st.error(f"Error: {e}")
+        auditor_panel(curr, net, total_exp, balance, epf_amount, selected_month, selected_year)
+
+# --- CACHE STATS ---
+# Filled in by traced_cache during this run; hit ratio = 1 - misses / calls
+with st.sidebar:
+    with st.expander("🧪 Cache stats", expanded=False):
+        st.json(st.session_state.get('_cache_stats', {}), expanded=True)